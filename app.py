@@ -1,20 +1,130 @@
-from flask import Flask, request, jsonify
+from flask import Flask, request, Response
+from flask.json.provider import DefaultJSONProvider
+from flask_caching import Cache
 import requests
-import google.generativeai as genai
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from urllib3.util.request import ACCEPT_ENCODING
 import os
 import logging
 import random
-import json
+import orjson
+import re
+import unicodedata
+import hashlib
+import functools
+import threading
+import time
+import contextlib
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+# The SDK builds the response schema with pydantic, which rejects typing.TypedDict before Python 3.12
+from typing_extensions import TypedDict
+from prometheus_client import CollectorRegistry, Counter, Histogram, REGISTRY, generate_latest, multiprocess, CONTENT_TYPE_LATEST
+
+class OrjsonProvider(DefaultJSONProvider):
+    """Route Flask's own JSON helpers (jsonify, request.json) through orjson"""
+
+    def dumps(self, obj, **kwargs):
+        return orjson.dumps(obj, default=self.default).decode()
+
+    def loads(self, s, **kwargs):
+        return orjson.loads(s)
 
 app = Flask(__name__)
+app.json = OrjsonProvider(app)
+
+class ParsedRequest(TypedDict):
+    genres: list[str]
+    search: str
+
+# Parse output is a short JSON object constrained to ParsedRequest, so cap
+# decoding well below the default
+PARSE_CONFIG = {
+    "temperature": 0.0,
+    "candidate_count": 1,
+    "max_output_tokens": 64,
+    "response_mime_type": "application/json",
+    "response_schema": ParsedRequest
+}
+
+# Dialogflow abandons a webhook call after WEBHOOK_DEADLINE seconds, and the
+# Gemini parse runs before the AniList fetch, so the two share that budget: 2s
+# here and 2.5s for AniList. Left alone, the SDK waits up to 600s and retries 503s.
+WEBHOOK_DEADLINE = 5
+PARSE_REQUEST_OPTIONS = {"timeout": 2, "retry": None}
+
+# Static instructions live in the system instruction, so each call only
+# sends the user's request as content
+PARSE_SYSTEM_PROMPT = """Extract the anime genres and an optional search term (a title, character or keyword) from the user's recommendation request.
+Use lowercase values, and an empty search when there is none."""
 
-# Configure Gemini
-genai.configure(api_key=os.getenv("GEMINI_API_KEY"))
-model = genai.GenerativeModel('gemini-pro')
+@functools.cache
+def parser_model():
+    """Gemini parser model, built on first use so cold starts and health checks skip the SDK import"""
+    import google.generativeai as genai
+
+    # REST transport so calls yield under gevent; gRPC would block the worker
+    genai.configure(api_key=os.getenv("GEMINI_API_KEY"), transport="rest")
+    return genai.GenerativeModel(
+        os.getenv("GEMINI_MODEL", 'gemini-2.5-flash-lite'),
+        system_instruction=PARSE_SYSTEM_PROMPT,
+        generation_config=PARSE_CONFIG
+    )
+
+# Number of titles shown per reply, and therefore fetched from AniList
+RECOMMENDATION_COUNT = 5
+
+# AniList GraphQL document, built once and minified to trim bytes on the wire
+ANILIST_QUERY = re.sub(r"\s+", " ", '''
+query ($search: String, $genre_in: [String], $perPage: Int) {
+    Page(page: 1, perPage: $perPage) {
+        media(
+            type: ANIME
+            search: $search
+            genre_in: $genre_in
+            sort: POPULARITY_DESC
+        ) {
+            title {
+                english
+                romaji
+            }
+            averageScore
+        }
+    }
+}
+''').strip()
+
+# Connect and read timeouts for AniList. With the single retry below, the worst
+# case (a connect timeout, then a full read) is 2.5s, which is what is left of
+# Dialogflow's ~5s webhook deadline after the Gemini parse.
+ANILIST_TIMEOUT = (0.5, 1.5)
+
+# Pooled keep-alive session so AniList calls reuse TCP/TLS connections.
+# The GraphQL POST is a read, so it is safe to retry once on gateway errors.
+# 429 is not retried: another attempt inside the deadline is certain to be
+# rate-limited again and only pushes back AniList's window. 504 is not retried
+# either, since it only arrives after the gateway has already waited.
+SESSION = requests.Session()
+# ACCEPT_ENCODING advertises br only when a brotli decoder is installed
+SESSION.headers.update({"Accept-Encoding": ACCEPT_ENCODING, "Content-Type": "application/json"})
+SESSION.mount("https://", HTTPAdapter(
+    pool_connections=32,
+    pool_maxsize=128,
+    max_retries=Retry(
+        total=1,
+        # A read that timed out once will not finish faster on a second try
+        read=0,
+        status_forcelist=[500, 502, 503],
+        allowed_methods=frozenset({"POST"}),
+        # A 503's Retry-After can exceed the webhook deadline
+        respect_retry_after_header=False
+    )
+))
 
 # Configure logging
 logging.basicConfig(
-    level=logging.INFO,
+    level=os.getenv("LOG_LEVEL", "INFO").upper(),
     format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
     handlers=[
         logging.FileHandler('debug.log'),
@@ -22,148 +132,326 @@ logging.basicConfig(
     ]
 )
 
+# Configure response cache (Redis is shared across workers; SimpleCache is per-process)
+REDIS_URL = os.getenv("REDIS_URL")
+cache = Cache(app, config={
+    'CACHE_TYPE': 'cache_backends.ZstdRedisCache' if REDIS_URL else 'SimpleCache',
+    'CACHE_REDIS_URL': REDIS_URL,
+    'CACHE_DEFAULT_TIMEOUT': 3600,
+    'CACHE_THRESHOLD': 4096,
+    # A slow Redis should cost a cache miss, not the webhook deadline
+    'CACHE_OPTIONS': {'socket_timeout': 0.5, 'socket_connect_timeout': 0.5} if REDIS_URL else None
+})
+
+# Configure metrics
+STAGE_LATENCY = Histogram(
+    'nikko_stage_latency_seconds',
+    'Latency of each stage of answering a webhook request',
+    ['stage'],
+    buckets=(.05, .1, .25, .5, 1, 2, 5, 10)
+)
+ANSWER_CACHE = Counter('nikko_answer_cache_total', 'Answer cache lookups', ['result'])
+
+# Gemini parses and AniList results change far less often than answers are requested
+SUB_RESULT_CACHE_TTL = 86400
+# Dead-end filters are remembered too, but briefly, in case AniList gains matches
+NEGATIVE_CACHE_TTL = 600
+
+# Sub-result lookups currently running, so concurrent identical misses wait on one call
+inflight_calls = {}
+inflight_lock = threading.Lock()
+
+# Background pool for overlapping AniList fetches with Gemini parsing
+io_pool = ThreadPoolExecutor(max_workers=8)
+
+NO_RESULTS_MESSAGE = "Wow, even the anime gods are ignoring you. Try again with less obscure preferences."
+SASSY_COMMENTS = (
+    "Took you long enough to ask. Here:",
+    "Ugh, fine. These might suit your basic taste:",
+    "I guess these mediocre picks might work:"
+)
+INVALID_QUERY_MESSAGE = "Use your words, human. Real ones, and fewer of them."
+UPSTREAM_ERROR_MESSAGE = "AniList is being tsundere 🎌 Try again later!"
+
+# Input limits, enforced before any Gemini or AniList call
+MAX_BODY_BYTES = 16384
+MAX_QUERY_LENGTH = 200
+# Werkzeug refuses to read bodies past this, including chunked uploads without a Content-Length
+app.config['MAX_CONTENT_LENGTH'] = MAX_BODY_BYTES
+# A real request contains at least one word of three or more letters
+WORD_LETTERS_RE = re.compile(r"[^\W\d_]{3,}")
+
+class AniListUnavailable(Exception):
+    """AniList could not be reached, so the answer must not be cached"""
+
+class LocalTTLCache:
+    """Small in-process LRU whose entries also expire after a fixed TTL"""
+
+    def __init__(self, maxsize=1024, ttl=300):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return None
+            expires, value = entry
+            if expires < time.monotonic():
+                del self.entries[key]
+                return None
+            self.entries.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        with self.lock:
+            self.entries[key] = (time.monotonic() + self.ttl, value)
+            self.entries.move_to_end(key)
+            if len(self.entries) > self.maxsize:
+                self.entries.popitem(last=False)
+
+# Per-process tier in front of the shared cache, so hot AniList params skip the Redis round-trip
+anilist_local_cache = LocalTTLCache()
+
+# AniList's genre collection, lowercased to match normalized queries
+ANILIST_GENRES = frozenset({
+    "action", "adventure", "comedy", "drama", "ecchi", "fantasy", "hentai",
+    "horror", "mahou shoujo", "mecha", "music", "mystery", "psychological",
+    "romance", "sci-fi", "slice of life", "sports", "supernatural", "thriller"
+})
+GENRE_RE = re.compile(r"\b(" + "|".join(sorted(map(re.escape, ANILIST_GENRES), key=len, reverse=True)) + r")\b")
+WORD_RE = re.compile(r"\w+")
+# Words that carry no search intent once the genres have been taken out
+FILLER_WORDS = frozenset({
+    "a", "an", "and", "anime", "animes", "any", "best", "for", "give", "good",
+    "great", "i", "me", "my", "need", "of", "or", "please", "pls", "recommend",
+    "recommendations", "series", "show", "shows", "some", "something", "suggest",
+    "the", "to", "top", "want", "watch", "with"
+})
+
+@contextlib.contextmanager
+def timer(stage):
+    """Record the wall-clock time of a block in the stage latency histogram"""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        STAGE_LATENCY.labels(stage).observe(time.perf_counter() - start)
+
+def normalize_query(text):
+    """NFKC-fold, lowercase and collapse whitespace so equivalent queries share a cache key"""
+    return re.sub(r"\s+", " ", unicodedata.normalize('NFKC', text).lower()).strip()
+
 def sanitize_genres(genres):
-    """Ensure proper genre formatting for AniList API"""
-    return [str(g).lower().strip() for g in genres if g and str(g).strip()]
+    """Ensure proper genre formatting for AniList API, dropping names AniList doesn't know"""
+    return [name for g in genres if g and (name := str(g).strip().lower()) in ANILIST_GENRES]
 
-def generate_nikko_response(text):
-    prompt = f"""
-    Parse this anime recommendation request into JSON format with: genres, themes, and search terms.
-    Return ONLY valid JSON with lowercase values. Example:
-    {{ "genres": ["action"], "themes": ["friendship"], "search": "ninja" }}
+def unknown_genres(genres):
+    """The tags sanitize_genres drops, such as "isekai", normalized the same way"""
+    return [name for g in genres if g and (name := str(g).strip().lower()) and name not in ANILIST_GENRES]
 
-    Request: {text}
-    """
+def generate_nikko_response(text):
     try:
-        response = model.generate_content(prompt)
+        with timer('gemini_parse'):
+            response = parser_model().generate_content(text, request_options=PARSE_REQUEST_OPTIONS)
+        if logging.root.isEnabledFor(logging.DEBUG):
+            # Shows how much of the static system prompt Gemini served from its prefix cache
+            usage = response.usage_metadata
+            logging.debug(
+                "Gemini usage: prompt=%s cached=%s output=%s",
+                usage.prompt_token_count,
+                getattr(usage, 'cached_content_token_count', 0),
+                usage.candidates_token_count
+            )
         return response.text
     except Exception as e:
-        logging.error(f"Gemini error: {str(e)}")
+        logging.error("Gemini error: %s", e)
         return None
 
 def query_anilist(genres=None, search=None):
-    query = '''
-    query ($search: String, $genre_in: [String]) {
-        Page(page: 1, perPage: 10) {
-            media(
-                type: ANIME
-                search: $search
-                genre_in: $genre_in
-                sort: POPULARITY_DESC
-            ) {
-                id
-                title {
-                    english
-                    romaji
-                }
-                genres
-                description(asHtml: false)
-                averageScore
-                episodes
-                siteUrl
-            }
-        }
-    }
-    '''
-
     variables = {
         "search": search.strip() if search else None,
-        "genre_in": sanitize_genres(genres) if genres else []
+        "genre_in": sanitize_genres(genres) if genres else [],
+        "perPage": RECOMMENDATION_COUNT
     }
 
     try:
-        response = requests.post(
-            'https://graphql.anilist.co',
-            json={'query': query, 'variables': variables},
-            timeout=15
-        )
+        with timer('anilist_fetch'):
+            response = SESSION.post(
+                'https://graphql.anilist.co',
+                json={'query': ANILIST_QUERY, 'variables': variables},
+                timeout=ANILIST_TIMEOUT
+            )
         response.raise_for_status()
-        data = response.json()
+        data = orjson.loads(response.content)
         
         if 'errors' in data:
             for error in data['errors']:
-                logging.error(f"AniList API Error: {error['message']}")
+                logging.error("AniList API Error: %s", error['message'])
             return None
             
         return data['data']['Page']['media']
     except Exception as e:
-        logging.error(f"AniList request failed: {str(e)}")
+        logging.error("AniList request failed: %s", e)
         return None
 
 def generate_sassy_response(anime_list):
     if not anime_list:
         return "Oh please, your taste is too unique even for me. Try asking for something that actually exists."
     
-    recommendations = "\n".join(
-        f"- {anime['title']['english'] or anime['title']['romaji']} ({anime['averageScore']}/100)"
-        for anime in anime_list[:5]
-    )
-    
-    sassy_comments = [
-        "Took you long enough to ask. Here:",
-        "Ugh, fine. These might suit your basic taste:",
-        "I guess these mediocre picks might work:"
-    ]
-    
-    return f"{random.choice(sassy_comments)}\n{recommendations}"
+    # str.join materializes its input anyway, so hand it a list rather than a generator
+    recommendations = "\n".join([
+        f"- {title['english'] or title['romaji'] or 'Untitled'} ({anime['averageScore'] or 'N/A'}/100)"
+        for anime in anime_list[:RECOMMENDATION_COUNT]
+        for title in (anime['title'],)
+    ])
+
+    return f"{random.choice(SASSY_COMMENTS)}\n{recommendations}"
 
 @app.route('/')
 def health_check():
     return "Nikko is ready to roast your anime tastes! 🎌", 200
 
-@app.route('/webhook', methods=['POST'])
-def chat_handler():
+def json_object_at(text, start):
+    """Return the balanced {...} block opening at text[start], ignoring braces inside JSON strings"""
+    depth = 0
+    in_string = escaped = False
+    for i in range(start, len(text)):
+        c = text[i]
+        if in_string:
+            if escaped:
+                escaped = False
+            elif c == '\\':
+                escaped = True
+            elif c == '"':
+                in_string = False
+        elif c == '"':
+            in_string = True
+        elif c == '{':
+            depth += 1
+        elif c == '}':
+            depth -= 1
+            if not depth:
+                return text[start:i + 1]
+    return None
+
+def extract_json(text):
+    """Decode JSON from model output, tolerating code fences and surrounding prose"""
     try:
-        dialogflow_request = request.json
-        logging.info(f"Raw Dialogflow request: {json.dumps(dialogflow_request, indent=2)}")
-        
-        # Extract parameters from Dialogflow
-        query_result = dialogflow_request.get('queryResult', {})
-        user_message = query_result.get('queryText', '')
-        parameters = query_result.get('parameters', {})
-        
-        # Try using Dialogflow parameters first
-        genres = parameters.get('AnimeGenre', [])
-        search = parameters.get('search-term', '')
-        
-        if not genres and not search:
-            # Fallback to Gemini parsing
-            gemini_response = generate_nikko_response(user_message)
-            if not gemini_response:
-                raise ValueError("Empty response from Gemini")
-                
-            parsed_data = json.loads(gemini_response)
-            genres = parsed_data.get('genres', [])
-            search = parsed_data.get('search', '')
-            logging.info(f"Gemini parsed data: {parsed_data}")
-
-        # Sanitize inputs
-        genres = sanitize_genres(genres)
-        search = search.strip() if search else None
-
-        # Query AniList
-        anime_list = query_anilist(
-            genres=genres if genres else None,
-            search=search
-        )
-        
-        # Generate response
-        response_text = generate_sassy_response(anime_list) if anime_list else \
-            "Wow, even the anime gods are ignoring you. Try again with less obscure preferences."
-            
-    except json.JSONDecodeError as e:
-        logging.error(f"JSON parsing failed: {str(e)}")
-        response_text = "Ugh, even my brain is glitching. Try again, human."
+        return orjson.loads(text)
+    except orjson.JSONDecodeError as e:
+        error = e
+    # A brace in the prose can open a block that isn't JSON, so try each one in turn
+    start = text.find('{')
+    while start != -1:
+        block = json_object_at(text, start)
+        if block is not None:
+            try:
+                return orjson.loads(block)
+            except orjson.JSONDecodeError:
+                pass
+        start = text.find('{', start + 1)
+    raise error
+
+def cache_key(prefix, params):
+    """Deterministic cache key: SHA-256 of the params' canonical JSON"""
+    return prefix + hashlib.sha256(orjson.dumps(params, option=orjson.OPT_SORT_KEYS)).hexdigest()
+
+def cache_get(key):
+    """Cache read that fails open: backend errors are logged and treated as a miss"""
+    try:
+        return cache.get(key)
     except Exception as e:
-        logging.error(f"Critical error: {str(e)}", exc_info=True)
-        response_text = "AniList is being tsundere 🎌 Try again later!"
+        logging.warning("Cache read failed: %s", e)
+        return None
 
-    # Dialogflow-compliant response format
-    return jsonify({
-        "fulfillmentText": response_text,
+def cache_set(key, value, timeout=None):
+    """Cache write that fails open: backend errors are logged and ignored"""
+    try:
+        cache.set(key, value, timeout=timeout)
+    except Exception as e:
+        logging.warning("Cache write failed: %s", e)
+
+def cached_call(key, fn, timeout, empty_timeout=None):
+    """Cache-aside lookup where concurrent misses on one key share a single fn() call"""
+    value = cache_get(key)
+    if value is not None:
+        return value
+
+    with inflight_lock:
+        future = inflight_calls.get(key)
+        leader = future is None
+        if leader:
+            future = inflight_calls[key] = Future()
+    if not leader:
+        # Dialogflow has dropped the reply by the deadline, so stop waiting on a stuck leader
+        return future.result(timeout=WEBHOOK_DEADLINE)
+
+    try:
+        value = fn()
+        if value is not None:
+            cache_set(key, value, timeout=timeout if value or empty_timeout is None else empty_timeout)
+        future.set_result(value)
+        return value
+    except BaseException as e:
+        future.set_exception(e)
+        raise
+    finally:
+        with inflight_lock:
+            del inflight_calls[key]
+
+def gemini_parse(text):
+    """Gemini parse of a normalized query"""
+    gemini_response = generate_nikko_response(text)
+    if not gemini_response:
+        raise ValueError("Empty response from Gemini")
+
+    parsed_data = extract_json(gemini_response)
+    logging.debug("Gemini parsed data: %s", parsed_data)
+    return parsed_data
+
+def fetch_anilist(genres, search):
+    """AniList results for normalized params; failed lookups (None) are never cached"""
+    key = cache_key("anilist:", {"genres": genres, "search": search})
+    anime_list = anilist_local_cache.get(key)
+    if anime_list is None:
+        anime_list = cached_call(
+            key,
+            lambda: query_anilist(genres=list(genres) or None, search=search),
+            SUB_RESULT_CACHE_TTL,
+            empty_timeout=NEGATIVE_CACHE_TTL
+        )
+        if anime_list is not None:
+            anilist_local_cache.set(key, anime_list)
+    return anime_list
+
+def keyword_parse(text):
+    """Parse plain genre requests like "5 best action romance anime" without Gemini"""
+    genres = GENRE_RE.findall(text)
+    if not genres:
+        return None
+    leftover = WORD_RE.findall(GENRE_RE.sub(" ", text))
+    if any(word not in FILLER_WORDS and not word.isdigit() for word in leftover):
+        return None
+    return {"genres": list(dict.fromkeys(genres)), "search": ""}
+
+def parse_request(text):
+    """Extract genres and search terms from free text via Gemini"""
+    return cached_call(cache_key("parse:", text), lambda: gemini_parse(text), SUB_RESULT_CACHE_TTL)
+
+def json_response(payload, status=200):
+    """Serialize a payload with orjson instead of Flask's stdlib encoder"""
+    return app.response_class(orjson.dumps(payload), status=status, mimetype='application/json')
+
+def dialogflow_response(text):
+    """Wrap a reply in the Dialogflow fulfillment format"""
+    return {
+        "fulfillmentText": text,
         "fulfillmentMessages": [{
             "text": {
-                "text": [response_text]
+                "text": [text]
             }
         }],
         "source": "webhook-nikko",
@@ -172,8 +460,123 @@ def chat_handler():
                 "expectUserResponse": False
             }
         }
-    })
+    }
 
-if __name__ == '__main__':
-    port = int(os.environ.get("PORT", 5000))
-    app.run(host='0.0.0.0', port=port)
+def read_dialogflow_request(payload):
+    """Query text, genres and search term from a Dialogflow request, or None if it is malformed"""
+    query_result = payload.get('queryResult') if isinstance(payload, dict) else None
+    if not isinstance(query_result, dict):
+        return None
+    user_message = query_result.get('queryText')
+    parameters = query_result.get('parameters') or {}
+    if not isinstance(user_message, str) or not isinstance(parameters, dict):
+        return None
+
+    genres = parameters.get('AnimeGenre') or []
+    search = parameters.get('search-term') or ''
+    if isinstance(genres, str):
+        genres = [genres]
+    if not isinstance(genres, list) or not isinstance(search, str):
+        return None
+    return user_message, tuple(sanitize_genres(genres)), search.strip()
+
+def recommend(user_message, genres, search):
+    """Resolve a request into a reply, raising on failures that must not be cached"""
+    prefetch = None
+    if not genres and not search:
+        parsed_data = keyword_parse(user_message)
+        if parsed_data is None:
+            # Speculatively fetch the unfiltered list while Gemini parses the request
+            prefetch = io_pool.submit(fetch_anilist, (), None)
+
+            # Fallback to Gemini parsing
+            parsed_data = parse_request(user_message)
+        genres = parsed_data.get('genres', [])
+        search = parsed_data.get('search', '')
+
+    # Sanitize inputs
+    search = search.strip() if search else None
+    if not search:
+        # Tags that aren't AniList genres narrow the results as a search term
+        # rather than silently widening them to the unfiltered list
+        search = " ".join(unknown_genres(genres)) or None
+    genres = sanitize_genres(genres)
+
+    # Query AniList, reusing the speculative fetch when Gemini found no filters
+    if prefetch and not genres and not search:
+        anime_list = prefetch.result()
+    else:
+        if prefetch:
+            prefetch.cancel()
+        anime_list = fetch_anilist(tuple(sorted(genres)), search)
+    if anime_list is None:
+        raise AniListUnavailable()
+
+    return generate_sassy_response(anime_list) if anime_list else NO_RESULTS_MESSAGE
+
+def cached_answer(norm_query, genres, search):
+    """Serialized Dialogflow response for a normalized query, shared through the cache backend"""
+    key = cache_key("answer:", {"query": norm_query, "genres": genres, "search": search})
+    body = cache_get(key)
+    if body is not None:
+        ANSWER_CACHE.labels('hit').inc()
+        return body
+
+    ANSWER_CACHE.labels('miss').inc()
+    reply = recommend(norm_query, list(genres), search)
+    body = orjson.dumps(dialogflow_response(reply))
+    # Empty answers expire with the AniList negative cache instead of sticking for an hour
+    cache_set(key, body, timeout=NEGATIVE_CACHE_TTL if reply == NO_RESULTS_MESSAGE else None)
+    return body
+
+@app.route('/metrics')
+def metrics():
+    registry = REGISTRY
+    if os.getenv("PROMETHEUS_MULTIPROC_DIR"):
+        # Aggregate every gunicorn worker's samples, not just those of the one serving this scrape
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    return Response(generate_latest(registry), mimetype=CONTENT_TYPE_LATEST)
+
+@app.route('/webhook', methods=['POST'])
+def chat_handler():
+    if (request.content_length or 0) > MAX_BODY_BYTES:
+        return json_response(dialogflow_response(INVALID_QUERY_MESSAGE), 413)
+    raw_request = request.get_data(cache=False)
+
+    try:
+        dialogflow_request = orjson.loads(raw_request)
+        if logging.root.isEnabledFor(logging.DEBUG):
+            logging.debug("Raw Dialogflow request: %s", raw_request.decode(errors='replace'))
+        
+        # Extract the query and Dialogflow's own parameters, which are tried before Gemini
+        fields = read_dialogflow_request(dialogflow_request)
+        # Dialogflow drops the body of non-2xx replies, so the canned reply goes out as a 200
+        if fields is None:
+            return json_response(dialogflow_response(INVALID_QUERY_MESSAGE))
+        user_message, genres, search = fields
+
+        # Reject empty, oversized or junk queries before spending a Gemini call
+        user_message = normalize_query(user_message)
+        if not user_message or len(user_message) > MAX_QUERY_LENGTH or not WORD_LETTERS_RE.search(user_message):
+            return json_response(dialogflow_response(INVALID_QUERY_MESSAGE))
+
+        # Identical queries are answered from cache without touching Gemini or AniList
+        with timer('answer'):
+            body = cached_answer(user_message, genres, search)
+        return app.response_class(body, mimetype='application/json')
+
+    except AniListUnavailable:
+        response_text = NO_RESULTS_MESSAGE
+    except FutureTimeoutError:
+        logging.warning("Gave up waiting on an identical in-flight lookup")
+        response_text = UPSTREAM_ERROR_MESSAGE
+    except orjson.JSONDecodeError as e:
+        logging.error("JSON parsing failed: %s", e)
+        response_text = "Ugh, even my brain is glitching. Try again, human."
+    except Exception as e:
+        logging.error("Critical error: %s", e, exc_info=True)
+        response_text = UPSTREAM_ERROR_MESSAGE
+
+    # Dialogflow-compliant response format
+    return json_response(dialogflow_response(response_text))
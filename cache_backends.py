@@ -0,0 +1,29 @@
+import pickle
+
+import zstandard
+from cachelib.serializers import RedisSerializer
+from flask_caching.backends.rediscache import RedisCache
+
+# Values below this size are stored as-is; compressing them saves nothing
+COMPRESS_MIN_BYTES = 1024
+ZSTD_MARKER = b"z"
+
+class ZstdRedisSerializer(RedisSerializer):
+    """Redis serializer that zstd-compresses large pickled values"""
+
+    def dumps(self, value, protocol=pickle.HIGHEST_PROTOCOL):
+        data = super().dumps(value, protocol)
+        if len(data) < COMPRESS_MIN_BYTES:
+            return data
+        return ZSTD_MARKER + zstandard.compress(data, 3)
+
+    def loads(self, value):
+        # Plain entries start with b"!" (pickle) or an ASCII digit, never the marker
+        if value is not None and value.startswith(ZSTD_MARKER):
+            value = zstandard.decompress(value[len(ZSTD_MARKER):])
+        return super().loads(value)
+
+class ZstdRedisCache(RedisCache):
+    """RedisCache whose large entries are stored zstd-compressed"""
+
+    serializer = ZstdRedisSerializer()
@@ -0,0 +1,30 @@
+import os
+import shutil
+import tempfile
+
+# Requests spend most of their time waiting on Gemini and AniList, so each
+# worker juggles many of them on gevent greenlets. The gevent worker
+# monkey-patches sockets and threading before the app is imported, which
+# makes the blocking requests/Gemini calls and the thread pool cooperative.
+bind = f"0.0.0.0:{os.environ.get('PORT', 5000)}"
+workers = int(os.environ.get("WEB_CONCURRENCY", 4))
+worker_class = "gevent"
+worker_connections = 1000
+timeout = 30
+
+# Each worker has its own metrics, so prometheus-client writes them to files
+# in this directory and /metrics aggregates them. Workers import the app after
+# this is set, which is when prometheus-client picks it up.
+prometheus_dir = os.environ.setdefault(
+    "PROMETHEUS_MULTIPROC_DIR", os.path.join(tempfile.gettempdir(), "nikko-prometheus")
+)
+
+def on_starting(server):
+    # Files left by a previous run would be summed into this one's metrics
+    shutil.rmtree(prometheus_dir, ignore_errors=True)
+    os.makedirs(prometheus_dir)
+
+def child_exit(server, worker):
+    from prometheus_client import multiprocess
+
+    multiprocess.mark_process_dead(worker.pid)
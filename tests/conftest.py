@@ -0,0 +1,6 @@
+import os
+import sys
+
+# Tests run against the per-process cache, never a shared Redis
+os.environ.pop("REDIS_URL", None)
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,263 @@
+import threading
+import time
+from concurrent.futures import TimeoutError as FutureTimeoutError
+
+import orjson
+import pytest
+
+import app
+from cache_backends import COMPRESS_MIN_BYTES, ZSTD_MARKER, ZstdRedisSerializer
+
+def post_query(text, parameters=None):
+    return app.app.test_client().post("/webhook", json={"queryResult": {"queryText": text, "parameters": parameters or {}}})
+
+def fake_anilist(calls):
+    """Stand-in for query_anilist that records its params and names its one result after them"""
+    def query_anilist(genres=None, search=None):
+        calls.append((tuple(genres or ()), search))
+        title = " ".join([*(genres or ()), search or ""]).strip() or "popular"
+        return [{"title": {"english": title, "romaji": None}, "averageScore": 80}]
+    return query_anilist
+
+def test_repeated_queries_are_answered_from_the_answer_cache(monkeypatch):
+    answered = []
+
+    def recommend(user_message, genres, search):
+        answered.append(user_message)
+        return "Try Cowboy Bebop."
+
+    monkeypatch.setattr(app, "recommend", recommend)
+    first = post_query("Space  Western please", {"AnimeGenre": ["sci-fi"]})
+    second = post_query("space western PLEASE", {"AnimeGenre": ["sci-fi"]})
+    assert first.json["fulfillmentText"] == second.json["fulfillmentText"] == "Try Cowboy Bebop."
+    assert answered == ["space western please"]
+
+def test_no_results_answers_expire_with_the_negative_cache(monkeypatch):
+    timeouts = []
+    real_set = app.cache.set
+
+    def recording_set(key, value, timeout=None):
+        timeouts.append(timeout)
+        return real_set(key, value, timeout=timeout)
+
+    monkeypatch.setattr(app.cache, "set", recording_set)
+    monkeypatch.setattr(app, "query_anilist", lambda genres=None, search=None: [])
+    response = post_query("haunted vending machines", {"AnimeGenre": ["horror"], "search-term": "vending machine"})
+    assert response.json["fulfillmentText"] == app.NO_RESULTS_MESSAGE
+    assert timeouts and set(timeouts) == {app.NEGATIVE_CACHE_TTL}
+
+def test_unfiltered_parse_reuses_the_prefetched_list(monkeypatch):
+    calls = []
+    monkeypatch.setattr(app, "generate_nikko_response", lambda text: '{"genres": [], "search": ""}')
+    monkeypatch.setattr(app, "query_anilist", fake_anilist(calls))
+    assert "popular" in app.recommend("surprise me with anything", [], "")
+    # The speculative fetch is the only AniList call, unless the list was already cached
+    assert calls in ([], [((), None)])
+
+def test_filtered_parse_replaces_the_prefetched_list(monkeypatch):
+    calls = []
+    monkeypatch.setattr(app, "generate_nikko_response", lambda text: '{"genres": ["action"], "search": ""}')
+    monkeypatch.setattr(app, "query_anilist", fake_anilist(calls))
+    reply = app.recommend("something with big fights", [], "")
+    assert "action" in reply
+    assert "popular" not in reply
+
+def test_keyword_parse_plain_genre_request():
+    assert app.keyword_parse("5 best action romance anime") == {"genres": ["action", "romance"], "search": ""}
+
+def test_keyword_parse_multi_word_genre():
+    assert app.keyword_parse("slice of life shows") == {"genres": ["slice of life"], "search": ""}
+
+@pytest.mark.parametrize("text", ["action anime like naruto", "anime like naruto"])
+def test_keyword_parse_defers_to_gemini(text):
+    assert app.keyword_parse(text) is None
+
+def test_keyword_parsed_queries_skip_gemini_and_the_prefetch(monkeypatch):
+    calls, submitted = [], []
+    monkeypatch.setattr(app, "generate_nikko_response", lambda text: pytest.fail("Gemini was called"))
+    monkeypatch.setattr(app, "query_anilist", fake_anilist(calls))
+    monkeypatch.setattr(app.io_pool, "submit", lambda *args: submitted.append(args))
+    assert "mecha" in app.recommend("best mecha anime", [], "")
+    assert submitted == []
+
+def test_unknown_gemini_genres_become_the_search_term(monkeypatch):
+    calls = []
+    monkeypatch.setattr(app, "generate_nikko_response", lambda text: '{"genres": ["isekai"], "search": ""}')
+    monkeypatch.setattr(app, "query_anilist", fake_anilist(calls))
+    assert "isekai" in app.recommend("reincarnated in another world stuff", [], "")
+    assert ((), "isekai") in calls
+
+def test_normalize_query_folds_width_case_and_whitespace():
+    assert app.normalize_query("  Ａｃｔｉｏｎ\u3000\tAnime \n") == "action anime"
+
+@pytest.mark.parametrize("text", [
+    '{"genres": ["action"], "search": ""}',
+    '```json\n{"genres": ["action"], "search": ""}\n```',
+    'Sure! {"genres": ["action"], "search": ""} Enjoy.',
+])
+def test_extract_json_tolerates_fences_and_prose(text):
+    assert app.extract_json(text) == {"genres": ["action"], "search": ""}
+
+def test_extract_json_skips_braces_in_quoted_prose():
+    assert app.extract_json('He said "hi {" then {"genres":[],"search":""}') == {"genres": [], "search": ""}
+
+def test_extract_json_ignores_braces_inside_strings():
+    assert app.extract_json('Here: {"genres":[],"search":"}{"} Enjoy.') == {"genres": [], "search": "}{"}
+
+def test_extract_json_raises_without_an_object():
+    with pytest.raises(orjson.JSONDecodeError):
+        app.extract_json("no json here {")
+
+def test_parser_model_builds_with_the_response_schema(monkeypatch):
+    # Building the model converts the schema but makes no network call
+    monkeypatch.setenv("GEMINI_API_KEY", "test-key")
+    app.parser_model.cache_clear()
+    try:
+        assert app.parser_model() is not None
+    finally:
+        app.parser_model.cache_clear()
+
+def test_gemini_and_anilist_worst_cases_fit_the_webhook_deadline(monkeypatch):
+    seen = {}
+
+    class OfflineModel:
+        def generate_content(self, text, **kwargs):
+            seen.update(kwargs)
+            raise RuntimeError("offline")
+
+    monkeypatch.setattr(app, "parser_model", OfflineModel)
+    assert app.generate_nikko_response("anime like naruto") is None
+    assert seen["request_options"]["retry"] is None
+
+    connect, read = app.ANILIST_TIMEOUT
+    # One connect retry, then a full read
+    assert seen["request_options"]["timeout"] + 2 * connect + read < app.WEBHOOK_DEADLINE
+
+def test_cached_call_shares_one_call_between_concurrent_misses():
+    calls = []
+    release = threading.Event()
+
+    def fn():
+        calls.append(1)
+        release.wait(5)
+        return ["result"]
+
+    results = []
+    threads = [
+        threading.Thread(target=lambda: results.append(app.cached_call("test:single-flight", fn, 60)))
+        for _ in range(5)
+    ]
+    for thread in threads:
+        thread.start()
+    while not calls:
+        time.sleep(0.01)
+    time.sleep(0.05)
+    release.set()
+    for thread in threads:
+        thread.join()
+
+    assert calls == [1]
+    assert results == [["result"]] * 5
+
+def test_cached_call_followers_give_up_on_a_stuck_leader(monkeypatch):
+    monkeypatch.setattr(app, "WEBHOOK_DEADLINE", 0.05)
+    started = threading.Event()
+    release = threading.Event()
+
+    def stuck():
+        started.set()
+        release.wait(5)
+        return "late"
+
+    leader = threading.Thread(target=app.cached_call, args=("test:stuck", stuck, 60))
+    leader.start()
+    started.wait(5)
+    try:
+        with pytest.raises(FutureTimeoutError):
+            app.cached_call("test:stuck", stuck, 60)
+    finally:
+        release.set()
+        leader.join()
+
+def test_cached_call_does_not_cache_failures():
+    def fail():
+        raise RuntimeError("upstream down")
+
+    with pytest.raises(RuntimeError):
+        app.cached_call("test:failure", fail, 60)
+    assert app.cached_call("test:failure", lambda: "ok", 60) == "ok"
+
+def test_cached_call_fails_open_when_the_cache_errors(monkeypatch):
+    def broken(*args, **kwargs):
+        raise ConnectionError("cache down")
+
+    monkeypatch.setattr(app.cache, "get", broken)
+    monkeypatch.setattr(app.cache, "set", broken)
+    assert app.cached_call("test:fail-open", lambda: "value", 60) == "value"
+
+def test_local_ttl_cache_evicts_least_recently_used():
+    cache = app.LocalTTLCache(maxsize=2, ttl=60)
+    cache.set("a", 1)
+    cache.set("b", 2)
+    cache.get("a")
+    cache.set("c", 3)
+    assert cache.get("b") is None
+    assert cache.get("a") == 1
+    assert cache.get("c") == 3
+
+def test_local_ttl_cache_expires_entries(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(app.time, "monotonic", lambda: now[0])
+    cache = app.LocalTTLCache(ttl=10)
+    cache.set("a", 1)
+    now[0] += 9
+    assert cache.get("a") == 1
+    now[0] += 2
+    assert cache.get("a") is None
+
+@pytest.mark.parametrize("value", [42, {"genres": ["action"]}])
+def test_zstd_serializer_stores_small_values_uncompressed(value):
+    serializer = ZstdRedisSerializer()
+    data = serializer.dumps(value)
+    assert not data.startswith(ZSTD_MARKER)
+    assert serializer.loads(data) == value
+
+def test_zstd_serializer_compresses_large_values():
+    serializer = ZstdRedisSerializer()
+    value = "x" * (COMPRESS_MIN_BYTES * 4)
+    data = serializer.dumps(value)
+    assert data.startswith(ZSTD_MARKER)
+    assert len(data) < COMPRESS_MIN_BYTES
+    assert serializer.loads(data) == value
+
+@pytest.mark.parametrize("text", ["", "a" * 201, "!!!"])
+def test_webhook_answers_invalid_queries_with_200(text):
+    response = post_query(text)
+    assert response.status_code == 200
+    assert response.json["fulfillmentText"] == app.INVALID_QUERY_MESSAGE
+
+@pytest.mark.parametrize("text", [
+    "I’m looking for something like Naruto",
+    "anime like Fate/Zero",
+    'anime like "Your Name"',
+    "something like [Oshi no Ko]",
+    "Hunter × Hunter vibes 🎌",
+])
+def test_webhook_accepts_everyday_punctuation(text, monkeypatch):
+    monkeypatch.setattr(app, "recommend", lambda user_message, genres, search: "Try these.")
+    assert post_query(text, {"AnimeGenre": ["action"]}).json["fulfillmentText"] == "Try these."
+
+@pytest.mark.parametrize("payload", [
+    [],
+    "action anime",
+    {"queryResult": None},
+    {"queryResult": {"queryText": None}},
+    {"queryResult": {"queryText": "action anime", "parameters": "action"}},
+    {"queryResult": {"queryText": "action anime", "parameters": {"search-term": ["naruto"]}}},
+    {"queryResult": {"queryText": "action anime", "parameters": {"AnimeGenre": {"name": "action"}}}},
+])
+def test_webhook_answers_malformed_requests_as_invalid(payload, caplog):
+    response = app.app.test_client().post("/webhook", json=payload)
+    assert response.status_code == 200
+    assert response.json["fulfillmentText"] == app.INVALID_QUERY_MESSAGE
+    assert "Critical error" not in caplog.text